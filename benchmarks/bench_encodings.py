@@ -0,0 +1,91 @@
+"""
+Compare bytes on the wire and encode/decode cost of the response encodings
+used by /user/profiles and the recommend endpoints.
+
+Run from the repository root:
+    python -m benchmarks.bench_encodings [n_profiles]
+"""
+import gzip
+import json
+import random
+import sys
+import time
+
+import response_encoding as enc
+
+REPEAT = 5
+
+
+def make_profiles(n):
+    rng = random.Random(42)
+    interests = ["Hiking", "Reading", "Cooking", "Music", "Travel", "Gaming", "Art", "Sports"]
+    return [
+        {
+            "id": i,
+            "username": f"user{i}",
+            "age": rng.randint(18, 70),
+            "introduction": "Hello, nice to meet you! " * rng.randint(1, 4),
+            "gender_id": rng.randint(1, 3),
+            "gender": "Mujer",
+            "sexual_orientation": "Mujer hetero",
+            "sexual_orientation_id": rng.randint(0, 5),
+            "interests": rng.sample(interests, rng.randint(0, 5)),
+            "images": [f"https://res.cloudinary.com/demo/image/upload/profiles/{i}/{k}.jpg" for k in range(rng.randint(0, 3))],
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def _time(fn):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def _decoders():
+    decoders = {enc.JSON_MEDIA_TYPE: lambda b: json.loads(b), enc.INT32_LE_MEDIA_TYPE: enc.unpack_ids}
+    if enc.msgpack is not None:
+        decoders[enc.MSGPACK_MEDIA_TYPE] = lambda b: enc.msgpack.unpackb(b)
+    return decoders
+
+
+def _decompressors():
+    decompressors = {None: lambda b: b, "gzip": gzip.decompress}
+    if enc.brotli is not None:
+        decompressors["br"] = enc.brotli.decompress
+    return decompressors
+
+
+def bench(label, payload, media_types):
+    print(f"\n{label}")
+    print(f"{'format':<34}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    decoders = _decoders()
+    decompressors = _decompressors()
+    for media_type in media_types:
+        if media_type not in decoders:
+            continue
+        for content_encoding, decompress in decompressors.items():
+            body, encode_ms = _time(lambda: enc.compress(enc.serialize(payload, media_type), content_encoding))
+            decoded, decode_ms = _time(lambda: decoders[media_type](decompress(body)))
+            assert decoded == payload
+            name = f"{media_type} + {content_encoding or 'identity'}"
+            print(f"{name:<34}{len(body):>12}{encode_ms:>12.2f}{decode_ms:>12.2f}")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    profiles = make_profiles(n)
+    bench(f"/user/profiles ({n} profiles)", profiles, [enc.JSON_MEDIA_TYPE, enc.MSGPACK_MEDIA_TYPE])
+    ids = [profile["id"] for profile in profiles]
+    bench(
+        f"recommend ids ({n} ids)",
+        ids,
+        [enc.JSON_MEDIA_TYPE, enc.MSGPACK_MEDIA_TYPE, enc.INT32_LE_MEDIA_TYPE],
+    )
+
+
+if __name__ == "__main__":
+    main()
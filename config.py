@@ -5,6 +5,7 @@ class Settings(BaseSettings):
     CLOUDINARY_CLOUD_NAME: str
     CLOUDINARY_API_KEY: str
     CLOUDINARY_API_SECRET: str
+    SNAPSHOT_PATH: str = "snapshots/profiles.npz"
 
     model_config = SettingsConfigDict(env_file=".env", extra='ignore')
 
@@ -0,0 +1,129 @@
+import math
+
+# Geohash alphabet (no a, i, l, o)
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Precision stored on profiles (~1.2km x 0.6km cells)
+GEOHASH_PRECISION = 6
+
+# Upper bound of cells used to cover a search area before falling back to a coarser precision
+MAX_COVER_CELLS = 16
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def _bits(precision):
+    """Return (lat_bits, lon_bits) for a geohash precision; longitude takes the extra bit."""
+    total = 5 * precision
+    return total // 2, (total + 1) // 2
+
+
+def _lat_index(lat, lat_bits):
+    cells = 1 << lat_bits
+    return min(cells - 1, max(0, int((lat + 90.0) / 180.0 * cells)))
+
+
+def _lon_index(lon, lon_bits):
+    cells = 1 << lon_bits
+    return min(cells - 1, max(0, int((lon + 180.0) / 360.0 * cells)))
+
+
+def _encode_index(lat_idx, lon_idx, precision):
+    """Interleave the cell indices (longitude first) into a base32 geohash."""
+    lat_bits, lon_bits = _bits(precision)
+    chars = []
+    value = 0
+    n = 0
+    lat_pos, lon_pos = lat_bits - 1, lon_bits - 1
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            bit = (lon_idx >> lon_pos) & 1
+            lon_pos -= 1
+        else:
+            bit = (lat_idx >> lat_pos) & 1
+            lat_pos -= 1
+        value = (value << 1) | bit
+        n += 1
+        if n == 5:
+            chars.append(_BASE32[value])
+            value = 0
+            n = 0
+    return "".join(chars)
+
+
+def encode(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Return the geohash of a point."""
+    lat_bits, lon_bits = _bits(precision)
+    return _encode_index(
+        _lat_index(latitude, lat_bits),
+        _lon_index(longitude, lon_bits),
+        precision,
+    )
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometers."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Return geohash prefixes whose cells together cover the circle of radius_km
+    around the point. Uses the finest precision (up to GEOHASH_PRECISION) that
+    needs at most MAX_COVER_CELLS cells.
+    """
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(-90.0, latitude - dlat)
+    max_lat = min(90.0, latitude + dlat)
+
+    # Longitude span grows towards the poles; cover the full circle when the box reaches one
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or dlat / cos_lat >= 180.0:
+        dlon = 180.0
+    else:
+        dlon = dlat / cos_lat
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_bits, lon_bits = _bits(precision)
+        lon_cells = 1 << lon_bits
+        lat_lo = _lat_index(min_lat, lat_bits)
+        lat_hi = _lat_index(max_lat, lat_bits)
+
+        if dlon >= 180.0:
+            lon_range = range(lon_cells)
+        else:
+            # floor, not int(): the west edge can be negative and must wrap too
+            lon_lo = math.floor((longitude - dlon + 180.0) / 360.0 * lon_cells)
+            lon_hi = math.floor((longitude + dlon + 180.0) / 360.0 * lon_cells)
+            # Wrap around the antimeridian
+            lon_range = [idx % lon_cells for idx in range(lon_lo, lon_hi + 1)]
+            if len(lon_range) > lon_cells:
+                lon_range = range(lon_cells)
+
+        count = (lat_hi - lat_lo + 1) * len(lon_range)
+        if count <= MAX_COVER_CELLS or precision == 1:
+            return sorted({
+                _encode_index(lat_idx, lon_idx, precision)
+                for lat_idx in range(lat_lo, lat_hi + 1)
+                for lon_idx in lon_range
+            })
+
+
+def prefix_range(prefix):
+    """
+    Return (low, high) bounds so that low <= geohash < high matches every
+    geohash starting with prefix. high is None when there is no upper bound.
+    Range predicates stay index friendly where LIKE 'prefix%' may not.
+    """
+    chars = list(prefix)
+    while chars:
+        pos = _BASE32.index(chars[-1])
+        if pos + 1 < len(_BASE32):
+            chars[-1] = _BASE32[pos + 1]
+            return prefix, "".join(chars)
+        chars.pop()
+    return prefix, None
@@ -1,11 +1,38 @@
+import logging
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from db import Base, engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from db import Base, engine, get_db
+from profile_cards import backfill_profile_cards
 
 from routers import users_router
 
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Profiles created before profile_cards existed must be readable from it.
+    # Goes through get_db so dependency overrides (tests) are honored.
+    sessions = app.dependency_overrides.get(get_db, get_db)()
+    db = next(sessions)
+    try:
+        backfill_profile_cards(db)
+    except IntegrityError:
+        # Another replica backfilled the same profiles concurrently
+        db.rollback()
+    except SQLAlchemyError:
+        db.rollback()
+        logger.exception("Profile card backfill failed; run python -m profile_cards")
+    finally:
+        sessions.close()
+    yield
+
 
-app = FastAPI(title="User Service")
+app = FastAPI(title="User Service", lifespan=lifespan)
 
 Base.metadata.create_all(bind=engine)
 
-app.include_router(users_router.router)
\ No newline at end of file
+app.include_router(users_router.router)
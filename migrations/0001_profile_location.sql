@@ -0,0 +1,12 @@
+-- Profile location and geohash index used by the recommend endpoints.
+-- create_all does not alter existing tables; apply once to databases created
+-- before this change:
+--   psql "$DATABASE_URL" -f migrations/0001_profile_location.sql
+--   sqlite3 app.db < migrations/0001_profile_location.sql
+
+ALTER TABLE profiles ADD COLUMN latitude FLOAT;
+ALTER TABLE profiles ADD COLUMN longitude FLOAT;
+ALTER TABLE profiles ADD COLUMN geohash VARCHAR(12);
+ALTER TABLE profiles ADD COLUMN last_seen_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS ix_profiles_geohash ON profiles (geohash);
@@ -0,0 +1,14 @@
+-- Content hash and idempotency key used to deduplicate profile image uploads.
+-- The unique indexes are what make concurrent retries safe.
+-- create_all does not alter existing tables; apply once to databases created
+-- before this change:
+--   psql "$DATABASE_URL" -f migrations/0002_profile_image_dedup.sql
+--   sqlite3 app.db < migrations/0002_profile_image_dedup.sql
+
+ALTER TABLE profile_images ADD COLUMN content_hash VARCHAR(64);
+ALTER TABLE profile_images ADD COLUMN idempotency_key VARCHAR(255);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_profile_images_profile_hash
+    ON profile_images (profile_id, content_hash);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_profile_images_profile_idempotency_key
+    ON profile_images (profile_id, idempotency_key);
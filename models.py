@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Boolean, Date, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, Date, DateTime, Float, ForeignKey, JSON, UniqueConstraint
 from sqlalchemy.orm import relationship
 from db import Base
 
@@ -26,6 +26,12 @@ class Profile(Base):
     # Images
     images = relationship("ProfileImage", back_populates="profile", cascade="all, delete-orphan")
 
+    # Location (geohash is the spatial index used to bound candidate queries)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)
+    last_seen_at = Column(DateTime, nullable=True)
+
 
 class Interest(Base):
     __tablename__ = "interests"
@@ -52,6 +58,15 @@ class ProfileImage(Base):
     image_url = Column(String, nullable=False)
     is_primary = Column(Boolean, default=False)
 
+    # Upload deduplication (SHA-256 of the file, client supplied Idempotency-Key)
+    content_hash = Column(String(64), nullable=True)
+    idempotency_key = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint("profile_id", "content_hash", name="uq_profile_images_profile_hash"),
+        UniqueConstraint("profile_id", "idempotency_key", name="uq_profile_images_profile_idempotency_key"),
+    )
+
     profile = relationship("Profile", back_populates="images")
 
 
@@ -70,4 +85,27 @@ class Gender(Base):
     id = Column(Integer, primary_key=True, index=True)
     gender_name = Column(String, nullable=False, unique=True)
 
-    profiles = relationship("Profile", back_populates="gender")
\ No newline at end of file
+    profiles = relationship("Profile", back_populates="gender")
+
+
+class ProfileCard(Base):
+    """
+    Denormalized read model of a profile, one row per profile.
+    Kept in sync by the mutating handlers in users_router (see profile_cards.py).
+    """
+    __tablename__ = "profile_cards"
+
+    profile_id = Column(Integer, ForeignKey("profiles.id", ondelete="CASCADE"), primary_key=True)
+    username = Column(String, nullable=False)
+    introduction = Column(String, nullable=False)
+    birthday = Column(Date, nullable=False)
+    gender_id = Column(Integer, nullable=False)
+    gender_name = Column(String, nullable=True)
+    sexual_orientation_id = Column(Integer, nullable=False, index=True)
+    orientation_name = Column(String, nullable=True)
+    interests = Column(JSON, nullable=False, default=list)
+    interest_ids = Column(JSON, nullable=False, default=list)
+    images = Column(JSON, nullable=False, default=list)
+    image_ids = Column(JSON, nullable=False, default=list)
+    primary_image_url = Column(String, nullable=True)
+    updated_at = Column(DateTime, nullable=False, index=True)
@@ -0,0 +1,150 @@
+"""
+Maintenance of the profile_cards read model.
+
+Every handler that mutates a profile, its interests or its images calls
+refresh_profile_card() before committing, so the card is updated in the
+same transaction. Cards missing for existing profiles (e.g. right after the
+table is introduced) are built by backfill_profile_cards() in the app's
+lifespan startup hook.
+Rebuild all cards with:
+    python -m profile_cards
+"""
+from datetime import date, datetime
+
+from sqlalchemy.orm import Session, joinedload
+
+import models
+
+AGE_BUCKET_SIZE = 5
+
+
+def calculate_age(birthday, today=None):
+    today = today or date.today()
+    return today.year - birthday.year - ((today.month, today.day) < (birthday.month, birthday.day))
+
+
+def age_bucket(birthday, today=None):
+    """
+    Lower bound of the 5-year age bucket (e.g. 27 -> 25). Computed at read
+    time like age, since a stored bucket goes stale on birthdays.
+    """
+    return calculate_age(birthday, today) // AGE_BUCKET_SIZE * AGE_BUCKET_SIZE
+
+
+def _load_profiles(db: Session):
+    # Avoid N+1 on gender/orientation/interests/images
+    return db.query(models.Profile).options(
+        joinedload(models.Profile.gender),
+        joinedload(models.Profile.sexual_orientation),
+        joinedload(models.Profile.interests),
+        joinedload(models.Profile.images),
+    )
+
+
+def _build_card(profile):
+    images = sorted(profile.images, key=lambda image: image.id)
+    primary = next((image for image in images if image.is_primary), images[0] if images else None)
+
+    return models.ProfileCard(
+        profile_id=profile.id,
+        username=profile.username,
+        introduction=profile.introduction,
+        birthday=profile.birthday,
+        gender_id=profile.gender_id,
+        gender_name=profile.gender.gender_name if profile.gender else None,
+        sexual_orientation_id=profile.sexual_orientation_id,
+        orientation_name=profile.sexual_orientation.orientation_name if profile.sexual_orientation else None,
+        interests=[interest.interest_name for interest in profile.interests],
+        interest_ids=[interest.id for interest in profile.interests],
+        images=[image.image_url for image in images],
+        image_ids=[image.id for image in images],
+        primary_image_url=primary.image_url if primary else None,
+        updated_at=datetime.utcnow(),
+    )
+
+
+def refresh_profile_card(db: Session, profile_id: int):
+    """
+    Recompute the card of a profile from the normalized tables, or remove it
+    when the profile no longer exists. Does not commit.
+    """
+    # Pending changes of the caller must be visible to the queries below
+    db.flush()
+    # populate_existing: handlers edit user_interests/profile_images directly,
+    # so collections already loaded in the session may be stale
+    profile = (
+        _load_profiles(db)
+        .populate_existing()
+        .filter(models.Profile.id == profile_id)
+        .first()
+    )
+    if profile is None:
+        delete_profile_card(db, profile_id)
+        return None
+    return db.merge(_build_card(profile))
+
+
+def delete_profile_card(db: Session, profile_id: int):
+    db.query(models.ProfileCard).filter(models.ProfileCard.profile_id == profile_id).delete(
+        synchronize_session=False
+    )
+
+
+def get_profile_card(db: Session, profile_id: int):
+    """Return the card of a profile, building it on a miss (e.g. before the first rebuild)."""
+    card = db.get(models.ProfileCard, profile_id)
+    if card is None and db.get(models.Profile, profile_id) is not None:
+        card = refresh_profile_card(db, profile_id)
+        db.commit()
+    return card
+
+
+def card_to_dict(card, today=None):
+    """Public shape shared by /user/profiles and batch lookups."""
+    return {
+        "id": card.profile_id,
+        "username": card.username,
+        "age": calculate_age(card.birthday, today),
+        "age_bucket": age_bucket(card.birthday, today),
+        "introduction": card.introduction,
+        "gender_id": card.gender_id,
+        "gender": card.gender_name,
+        "sexual_orientation": card.orientation_name,
+        "sexual_orientation_id": card.sexual_orientation_id,
+        "interests": card.interests,
+        "images": card.images,
+    }
+
+
+def backfill_profile_cards(db: Session):
+    """Build cards for profiles that have none. Returns the number of cards written."""
+    has_card = (
+        db.query(models.ProfileCard)
+        .filter(models.ProfileCard.profile_id == models.Profile.id)
+        .exists()
+    )
+    cards = [_build_card(profile) for profile in _load_profiles(db).filter(~has_card).all()]
+    if cards:
+        db.add_all(cards)
+        db.commit()
+    return len(cards)
+
+
+def rebuild_profile_cards(db: Session):
+    """Recompute every card from scratch. Returns the number of cards written."""
+    db.query(models.ProfileCard).delete(synchronize_session=False)
+    cards = [_build_card(profile) for profile in _load_profiles(db).all()]
+    db.add_all(cards)
+    db.commit()
+    return len(cards)
+
+
+if __name__ == "__main__":
+    from db import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        print(f"Rebuilt {rebuild_profile_cards(session)} profile cards")
+    finally:
+        session.close()
@@ -0,0 +1,224 @@
+"""
+Columnar snapshot of all profiles for offline matching.
+
+The snapshot is a single uncompressed .npz file with one array per column,
+rows sorted by profile id:
+    ids, gender_id, orientation_id, birthday   (int32, birthday as date ordinal)
+    interest_indptr (int64, n + 1), interest_ids (int32)   CSR of interests
+    generated_at    (int64, microseconds since epoch, UTC)
+    version         (int32)
+
+Members are stored without compression, so load_snapshot() can memory-map
+each array straight from the file. np.load() reads it as a regular .npz too.
+
+Snapshots are incremental: only profile_cards updated since the previous
+snapshot are read, unchanged rows are copied from it and deleted profiles
+dropped. Generate with:
+    python -m profile_snapshot [path] [--full]
+or POST /user/profiles/snapshot; GET only serves the last one written.
+"""
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+import models
+from profile_cards import backfill_profile_cards
+
+SNAPSHOT_VERSION = 1
+
+ROW_COLUMNS = ("ids", "gender_id", "orientation_id", "birthday")
+
+# Rows updated shortly before the previous snapshot may have committed after it
+SNAPSHOT_OVERLAP = timedelta(minutes=5)
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _to_micros(moment):
+    return int((moment - _EPOCH) / timedelta(microseconds=1))
+
+
+def _from_micros(micros):
+    return _EPOCH + timedelta(microseconds=int(micros))
+
+
+def _take_rows(indptr, values, rows):
+    """Select rows of a CSR structure, returning (indptr, values)."""
+    starts = indptr[:-1][rows]
+    lengths = indptr[1:][rows] - starts
+    new_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_indptr[1:])
+    gather = np.arange(new_indptr[-1], dtype=np.int64)
+    gather += np.repeat(starts - new_indptr[:-1], lengths)
+    return new_indptr, values[gather]
+
+
+def _arrays_from_rows(rows):
+    """Build snapshot columns from (id, gender_id, orientation_id, birthday, interest_ids) rows."""
+    rows = sorted(rows, key=lambda row: row[0])
+    lengths = [len(row[4] or []) for row in rows]
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=indptr[1:])
+    return {
+        "ids": np.array([row[0] for row in rows], dtype=np.int32),
+        "gender_id": np.array([row[1] for row in rows], dtype=np.int32),
+        "orientation_id": np.array([row[2] for row in rows], dtype=np.int32),
+        "birthday": np.array([row[3].toordinal() for row in rows], dtype=np.int32),
+        "interest_indptr": indptr,
+        "interest_ids": np.array(
+            [interest_id for row in rows for interest_id in (row[4] or [])], dtype=np.int32
+        ),
+    }
+
+
+def _merge(previous, keep, changed):
+    """Rows of previous selected by the keep mask plus the changed arrays, sorted by id."""
+    keep_rows = np.flatnonzero(keep)
+    kept_indptr, kept_interests = _take_rows(
+        previous["interest_indptr"], previous["interest_ids"], keep_rows
+    )
+    merged = {
+        column: np.concatenate([previous[column][keep_rows], changed[column]])
+        for column in ROW_COLUMNS
+    }
+    indptr = np.concatenate([kept_indptr, changed["interest_indptr"][1:] + kept_indptr[-1]])
+    interests = np.concatenate([kept_interests, changed["interest_ids"]])
+
+    order = np.argsort(merged["ids"], kind="stable")
+    for column in ROW_COLUMNS:
+        merged[column] = merged[column][order]
+    merged["interest_indptr"], merged["interest_ids"] = _take_rows(indptr, interests, order)
+    return merged
+
+
+def _card_rows(query):
+    return query.with_entities(
+        models.ProfileCard.profile_id,
+        models.ProfileCard.gender_id,
+        models.ProfileCard.sexual_orientation_id,
+        models.ProfileCard.birthday,
+        models.ProfileCard.interest_ids,
+    ).all()
+
+
+def build_snapshot(db: Session, previous=None):
+    """
+    Return the snapshot arrays and the number of profile rows read from the
+    database. With a previous snapshot only cards updated since it are read.
+    """
+    generated_at = datetime.utcnow()
+    cards = db.query(models.ProfileCard)
+
+    if previous is None:
+        rows = _card_rows(cards)
+        arrays = _arrays_from_rows(rows)
+    else:
+        since = _from_micros(previous["generated_at"]) - SNAPSHOT_OVERLAP
+        rows = _card_rows(cards.filter(models.ProfileCard.updated_at >= since))
+        changed = _arrays_from_rows(rows)
+        current_ids = np.array(
+            [profile_id for (profile_id,) in db.query(models.ProfileCard.profile_id).all()],
+            dtype=np.int32,
+        )
+        # Drop deleted profiles and the stale version of changed ones
+        keep = np.isin(previous["ids"], current_ids) & ~np.isin(previous["ids"], changed["ids"])
+        arrays = _merge(previous, keep, changed)
+
+    arrays["generated_at"] = np.array(_to_micros(generated_at), dtype=np.int64)
+    arrays["version"] = np.array(SNAPSHOT_VERSION, dtype=np.int32)
+    return arrays, len(rows)
+
+
+def write_snapshot(path, arrays):
+    """Write the arrays atomically as an uncompressed .npz."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".npz.tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            np.savez(tmp, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path, mmap=True):
+    """
+    Load a snapshot as {column: array}. With mmap the arrays are read-only
+    views into the file (no copy); otherwise they are read into memory.
+    """
+    if not mmap:
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as raw:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} is compressed and cannot be memory-mapped")
+            # Local file header: 30 fixed bytes, then file name and extra field
+            raw.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(raw.read(4), dtype="<u2")
+            raw.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            if np.lib.format.read_magic(raw) == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(raw)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(raw)
+            name = info.filename[:-len(".npy")]
+            if shape == ():
+                arrays[name] = np.frombuffer(raw.read(dtype.itemsize), dtype=dtype).reshape(())
+            elif 0 in shape:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(
+                    path,
+                    dtype=dtype,
+                    mode="r",
+                    offset=raw.tell(),
+                    shape=shape,
+                    order="F" if fortran_order else "C",
+                )
+    return arrays
+
+
+def _read_previous(path):
+    try:
+        previous = load_snapshot(path, mmap=False)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+    if int(previous.get("version", -1)) != SNAPSHOT_VERSION:
+        return None
+    return previous
+
+
+def export_snapshot(db: Session, path, full=False):
+    """
+    Write the snapshot at path, incrementally from the one already there
+    unless full. Returns (profile_count, rows_read).
+    """
+    # The snapshot is read from profile_cards; no profile may be left out
+    backfill_profile_cards(db)
+    previous = None if full else _read_previous(path)
+    arrays, rows_read = build_snapshot(db, previous)
+    write_snapshot(path, arrays)
+    return len(arrays["ids"]), rows_read
+
+
+if __name__ == "__main__":
+    from config import settings
+    from db import SessionLocal
+
+    args = [arg for arg in sys.argv[1:] if arg != "--full"]
+    snapshot_path = args[0] if args else settings.SNAPSHOT_PATH
+    session = SessionLocal()
+    try:
+        count, read = export_snapshot(session, snapshot_path, full="--full" in sys.argv)
+        print(f"Wrote {count} profiles to {snapshot_path} ({read} read from the database)")
+    finally:
+        session.close()
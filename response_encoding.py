@@ -0,0 +1,128 @@
+import gzip
+import json
+import struct
+
+from fastapi import Request, Response
+
+try:
+    import msgpack
+except ImportError:  # optional, JSON is served instead
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is served instead
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+INT32_LE_MEDIA_TYPE = "application/x-int32-le"
+
+# Bodies smaller than this are not worth the compression overhead
+MIN_COMPRESS_SIZE = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _accepted(header):
+    """Parse an Accept / Accept-Encoding header into {token: q}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+def _is_id_list(payload):
+    return isinstance(payload, list) and all(type(item) is int for item in payload)
+
+
+def pack_ids(ids):
+    """Pack a list of IDs as little-endian signed 32-bit integers."""
+    return struct.pack(f"<{len(ids)}i", *ids)
+
+
+def unpack_ids(data):
+    """Inverse of pack_ids."""
+    return list(struct.unpack(f"<{len(data) // 4}i", data))
+
+
+def choose_media_type(accept, payload):
+    """Pick the best body format the client accepts for this payload."""
+    accepted = _accepted(accept)
+    candidates = [JSON_MEDIA_TYPE]
+    if msgpack is not None:
+        candidates.append(MSGPACK_MEDIA_TYPE)
+    if _is_id_list(payload):
+        candidates.append(INT32_LE_MEDIA_TYPE)
+
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    for media_type in candidates:
+        q = accepted.get(media_type, 0.0)
+        # Prefer the more compact format on ties (candidates are ordered by size)
+        if q > 0 and q >= best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def choose_content_encoding(accept_encoding):
+    """Pick the accepted br or gzip encoding with the highest q, None for identity."""
+    accepted = _accepted(accept_encoding)
+    candidates = ["gzip"]
+    if brotli is not None:
+        candidates.append("br")
+
+    best, best_q = None, 0.0
+    for content_encoding in candidates:
+        q = accepted.get(content_encoding, 0.0)
+        # Prefer br on ties (candidates are ordered by compression ratio)
+        if q > 0 and q >= best_q:
+            best, best_q = content_encoding, q
+    return best
+
+
+def serialize(payload, media_type):
+    if media_type == MSGPACK_MEDIA_TYPE:
+        return msgpack.packb(payload)
+    if media_type == INT32_LE_MEDIA_TYPE:
+        return pack_ids(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def compress(body, content_encoding):
+    if content_encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if content_encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def negotiated_response(request: Request, payload):
+    """
+    Build a response for a JSON-compatible payload honoring the Accept
+    (JSON, MessagePack, packed int32 IDs) and Accept-Encoding (br, gzip) headers.
+    """
+    media_type = choose_media_type(request.headers.get("accept"), payload)
+    body = serialize(payload, media_type)
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    content_encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        content_encoding = choose_content_encoding(request.headers.get("accept-encoding"))
+    if content_encoding:
+        body = compress(body, content_encoding)
+        headers["Content-Encoding"] = content_encoding
+
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -1,10 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-from sqlalchemy.orm import Session, joinedload
-from datetime import date
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status, UploadFile, File
+from fastapi.responses import FileResponse
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import date, datetime
+import hashlib
+import os
 from typing import List
 
+from config import settings
 from db import get_db
+import geo
 import models, schemas
+from response_encoding import negotiated_response
+from profile_cards import card_to_dict, calculate_age, delete_profile_card, get_profile_card, refresh_profile_card
+from profile_snapshot import export_snapshot
 from cloudinary_config import upload_image
 
 router = APIRouter(prefix="/user", tags=["User"])
@@ -28,49 +38,28 @@ def get_own_profile(
     db: Session = Depends(get_db)
 ):
     """Get the profile of the authenticated user."""
-    # Avoid N+1 on gender/orientation/interests/images
-    profile = (
-        db.query(models.Profile)
-        .options(
-            joinedload(models.Profile.gender),
-            joinedload(models.Profile.sexual_orientation),
-            joinedload(models.Profile.interests),
-            joinedload(models.Profile.images),
-        )
-        .filter(models.Profile.id == user_id)
-        .first()
-    )
+    # Single-row read from the denormalized card
+    card = get_profile_card(db, user_id)
     
-    if not profile:
+    if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
     
-    # Calculate age
-    today = date.today()
-    age = today.year - profile.birthday.year - ((today.month, today.day) < (profile.birthday.month, profile.birthday.day))
-    
-    # Get interests
-    interests = [interest.interest_name for interest in profile.interests]
-    
-    # Get images
-    images = [image.image_url for image in profile.images]
-    image_ids = [image.id for image in profile.images]
-    
     return {
-        "id": profile.id,
-        "username": profile.username,
-        "introduction": profile.introduction,
-        "age": age,
-        "birthday": profile.birthday,
-        "gender_id": profile.gender_id,
-        "gender": profile.gender.gender_name if profile.gender else None,
-        "sexual_orientation_id": profile.sexual_orientation_id,
-        "sexual_orientation": profile.sexual_orientation.orientation_name if profile.sexual_orientation else None,
-        "interests": interests,
-        "images": images,
-        "image_ids": image_ids
+        "id": card.profile_id,
+        "username": card.username,
+        "introduction": card.introduction,
+        "age": calculate_age(card.birthday),
+        "birthday": card.birthday,
+        "gender_id": card.gender_id,
+        "gender": card.gender_name,
+        "sexual_orientation_id": card.sexual_orientation_id,
+        "sexual_orientation": card.orientation_name,
+        "interests": card.interests,
+        "images": card.images,
+        "image_ids": card.image_ids
     }
 
 
@@ -108,16 +97,78 @@ def update_profile(
         for interest_id in profile_data.interest_ids:
             db.add(models.UserInterest(profile_id=user_id, interest_id=interest_id))
 
+    refresh_profile_card(db, user_id)
     db.commit()
     return {"success": True, "user_id": user_id}
 
+@router.patch("/profile/location")
+def update_location(
+    user_id: int,
+    location: schemas.LocationUpdate,
+    db: Session = Depends(get_db),
+):
+    """Update the user's last known location and last-seen timestamp."""
+    profile = db.query(models.Profile).filter(models.Profile.id == user_id).first()
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+
+    profile.latitude = location.latitude
+    profile.longitude = location.longitude
+    profile.geohash = geo.encode(location.latitude, location.longitude)
+    profile.last_seen_at = datetime.utcnow()
+
+    db.commit()
+    return {"success": True, "user_id": user_id, "geohash": profile.geohash}
+
+# Images are hashed while read in chunks of this size
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+
+
+def _existing_image_response(image):
+    return {
+        "message": "Image already uploaded",
+        "image_id": image.id,
+        "image_url": image.image_url,
+        "is_primary": image.is_primary
+    }
+
+
+def _find_existing_image(db, user_id, content_hash, idempotency_key):
+    """
+    Return the stored image with this content hash or idempotency key, if any.
+    Raises 409 when the idempotency key was already used for a different file.
+    """
+    conditions = [models.ProfileImage.content_hash == content_hash]
+    if idempotency_key:
+        conditions.append(models.ProfileImage.idempotency_key == idempotency_key)
+    existing = db.query(models.ProfileImage).filter(
+        models.ProfileImage.profile_id == user_id,
+        or_(*conditions)
+    ).all()
+
+    for image in existing:
+        if idempotency_key and image.idempotency_key == idempotency_key and image.content_hash != content_hash:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Idempotency-Key was already used for a different image"
+            )
+    return existing[0] if existing else None
+
+
 @router.post("/profile/upload-image")
 async def upload_profile_image(
     user_id: int,
     file: UploadFile = File(...),
+    idempotency_key: str | None = Header(None),
     db: Session = Depends(get_db)
 ):
-    """Upload a profile image to Cloudinary."""
+    """
+    Upload a profile image to Cloudinary.
+    Re-submitting the same image (same SHA-256) returns the existing record
+    without uploading again. Reusing an Idempotency-Key with a different
+    image is rejected with 409.
+    """
     # Verify profile exists
     profile = db.query(models.Profile).filter(models.Profile.id == user_id).first()
     if not profile:
@@ -125,7 +176,32 @@ async def upload_profile_image(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Profile not found"
         )
+
+    # Validate file type
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="File must be an image"
+        )
     
+    # Read in chunks, hashing as we go and enforcing the 5MB max
+    hasher = hashlib.sha256()
+    file_content = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        file_content.extend(chunk)
+        if len(file_content) > MAX_IMAGE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Image size must be less than 5MB"
+            )
+        hasher.update(chunk)
+    content_hash = hasher.hexdigest()
+
+    # Same image already stored for this profile, or a retried request
+    existing = _find_existing_image(db, user_id, content_hash, idempotency_key)
+    if existing:
+        return _existing_image_response(existing)
+
     # Check current image count
     current_images = db.query(models.ProfileImage).filter(
         models.ProfileImage.profile_id == user_id
@@ -137,48 +213,44 @@ async def upload_profile_image(
             detail="Maximum 6 images allowed"
         )
     
-    # Validate file type
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="File must be an image"
-        )
-    
-    # Validate file size (5MB max)
-    file_content = await file.read()
-    if len(file_content) > 5 * 1024 * 1024:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Image size must be less than 5MB"
-        )
-    
     try:
         # Upload to Cloudinary
-        image_url = upload_image(file_content, folder=f"profiles/{user_id}")
-        
-        # Save to database
-        is_primary = current_images == 0
-        profile_image = models.ProfileImage(
-            profile_id=user_id,
-            image_url=image_url,
-            is_primary=is_primary
-        )
-        db.add(profile_image)
-        db.commit()
-        db.refresh(profile_image)
-        
-        return {
-            "message": "Image uploaded successfully",
-            "image_id": profile_image.id,
-            "image_url": image_url,
-            "is_primary": is_primary
-        }
+        image_url = upload_image(bytes(file_content), folder=f"profiles/{user_id}")
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to upload image: {str(e)}"
         )
 
+    # Save to database
+    is_primary = current_images == 0
+    profile_image = models.ProfileImage(
+        profile_id=user_id,
+        image_url=image_url,
+        is_primary=is_primary,
+        content_hash=content_hash,
+        idempotency_key=idempotency_key
+    )
+    db.add(profile_image)
+    try:
+        refresh_profile_card(db, user_id)
+        db.commit()
+    except IntegrityError:
+        # A concurrent retry stored it first
+        db.rollback()
+        existing = _find_existing_image(db, user_id, content_hash, idempotency_key)
+        if existing:
+            return _existing_image_response(existing)
+        raise
+    db.refresh(profile_image)
+    
+    return {
+        "message": "Image uploaded successfully",
+        "image_id": profile_image.id,
+        "image_url": image_url,
+        "is_primary": is_primary
+    }
+
 @router.delete("/profile/image/{image_id}")
 def delete_profile_image(
     image_id: int,
@@ -200,6 +272,7 @@ def delete_profile_image(
     
     # Delete from database (Cloudinary deletion is optional)
     db.delete(image)
+    refresh_profile_card(db, user_id)
     db.commit()
     
     return {"message": "Image deleted successfully"}
@@ -228,8 +301,8 @@ def create_profile(
     )
     
     db.add(new_profile)
-    db.commit()
-    db.refresh(new_profile)
+    # Flush only: profile, interests, images and card commit together
+    db.flush()
     
     if profile_data.interest_ids:
         for interest_id in profile_data.interest_ids:
@@ -248,6 +321,7 @@ def create_profile(
             )
             db.add(profile_image)
     
+    refresh_profile_card(db, new_profile.id)
     db.commit()
     
     return {
@@ -258,38 +332,52 @@ def create_profile(
 
 
 @router.get("/profiles")
-def list_all_profiles(db: Session = Depends(get_db)):
-    """Return all user profiles with gender and sexual_orientation as text for matching."""
-    # Avoid N+1 queries (gender/orientation/interests/images)
-    profiles = (
-        db.query(models.Profile)
-        .options(
-            joinedload(models.Profile.gender),
-            joinedload(models.Profile.sexual_orientation),
-            joinedload(models.Profile.interests),
-            joinedload(models.Profile.images),
+def list_all_profiles(request: Request, db: Session = Depends(get_db)):
+    """
+    Return all user profiles with gender and sexual_orientation as text for matching.
+    Supports MessagePack and gzip/br via Accept / Accept-Encoding.
+    """
+    # Single-table read from the denormalized cards
+    today = date.today()
+    result = [card_to_dict(card, today) for card in db.query(models.ProfileCard).all()]
+    return negotiated_response(request, result)
+
+
+@router.get("/profiles/batch")
+def get_profiles_batch(
+    request: Request,
+    ids: List[int] = Query(...),
+    db: Session = Depends(get_db)
+):
+    """Return the profiles with the given IDs (missing ones are skipped), same shape as /profiles."""
+    today = date.today()
+    cards = db.query(models.ProfileCard).filter(models.ProfileCard.profile_id.in_(ids)).all()
+    return negotiated_response(request, [card_to_dict(card, today) for card in cards])
+
+
+@router.get("/profiles/snapshot")
+def get_profiles_snapshot():
+    """Download the last columnar profile snapshot (.npz) for offline matching."""
+    if not os.path.exists(settings.SNAPSHOT_PATH):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Snapshot not generated yet"
         )
-        .all()
+    return FileResponse(
+        settings.SNAPSHOT_PATH,
+        media_type="application/octet-stream",
+        filename="profiles.npz"
     )
-    result = []
-    for profile in profiles:
-        today = date.today()
-        age = today.year - profile.birthday.year - ((today.month, today.day) < (profile.birthday.month, profile.birthday.day))
-        
-        profile_dict = {
-            "id": profile.id,
-            "username": profile.username,
-            "age": age,
-            "introduction": profile.introduction,
-            "gender_id": profile.gender_id,
-            "gender": profile.gender.gender_name if profile.gender else None,
-            "sexual_orientation": profile.sexual_orientation.orientation_name if profile.sexual_orientation else None,
-            "sexual_orientation_id": profile.sexual_orientation_id,
-            "interests": [interest.interest_name for interest in profile.interests],
-            "images": [image.image_url for image in profile.images]
-        }
-        result.append(profile_dict)
-    return result
+
+
+@router.post("/profiles/snapshot")
+def create_profiles_snapshot(full: bool = False, db: Session = Depends(get_db)):
+    """
+    Regenerate the columnar profile snapshot.
+    Incremental from the last snapshot unless full=true.
+    """
+    profile_count, rows_read = export_snapshot(db, settings.SNAPSHOT_PATH, full=full)
+    return {"success": True, "profiles": profile_count, "rows_read": rows_read}
 
 
 @router.delete("/profile")
@@ -314,6 +402,7 @@ def delete_profile(
         synchronize_session=False
     )
 
+    delete_profile_card(db, user_id)
     db.delete(profile)
     db.commit()
     return {"success": True, "user_id": user_id}
@@ -322,84 +411,149 @@ def delete_profile(
 @router.get("/{user_id}/interests")
 def get_user_interests(user_id: int, db: Session = Depends(get_db)):
     """Return the list of interest IDs for a given user."""
-    profile = db.query(models.Profile).filter(models.Profile.id == user_id).first()
-    if not profile:
+    card = get_profile_card(db, user_id)
+    if not card:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User profile not found"
         )
     
     # Return list of interest names (or IDs, based on matching service needs)
-    return [interest.interest_name for interest in profile.interests]
+    return card.interests
+
+
+def location_params(
+    latitude: float | None = Query(None, ge=-90, le=90),
+    longitude: float | None = Query(None, ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=20000),
+    limit: int | None = Query(None, gt=0),
+):
+    """Optional location filter shared by the recommend endpoints."""
+    if (latitude is None) != (longitude is None):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="latitude and longitude must be given together"
+        )
+    return {
+        "latitude": latitude,
+        "longitude": longitude,
+        "radius_km": radius_km,
+        "limit": limit,
+    }
+
+
+def _recommend_ids(db, orientation_ids, latitude=None, longitude=None, radius_km=50, limit=None):
+    """
+    Return IDs of profiles with one of the given orientations.
+    When a location is given, candidates are bounded by the geohash cells
+    covering radius_km, filtered by exact distance and returned nearest first
+    (at most limit of them). Profiles without a location are skipped then.
+    """
+    query = db.query(models.Profile).filter(
+        models.Profile.sexual_orientation_id.in_(orientation_ids)
+    )
+    if latitude is None or longitude is None:
+        return [profile.id for profile in query.all()]
+
+    # Index range per covering cell instead of scanning every profile
+    cell_filters = []
+    for prefix in geo.covering_cells(latitude, longitude, radius_km):
+        low, high = geo.prefix_range(prefix)
+        if high is None:
+            cell_filters.append(models.Profile.geohash >= low)
+        else:
+            cell_filters.append(and_(models.Profile.geohash >= low, models.Profile.geohash < high))
+
+    rows = (
+        query.with_entities(models.Profile.id, models.Profile.latitude, models.Profile.longitude)
+        .filter(or_(*cell_filters))
+        .all()
+    )
+
+    nearby = []
+    for profile_id, lat, lon in rows:
+        distance = geo.haversine_km(latitude, longitude, lat, lon)
+        if distance <= radius_km:
+            nearby.append((distance, profile_id))
+    nearby.sort()
+    if limit is not None:
+        nearby = nearby[:limit]
+    return [profile_id for _, profile_id in nearby]
 
 
 @router.get("/profiles/recommend/male-hetero")
-def list_users_for_male_hetero(db: Session = Depends(get_db)):
+def list_users_for_male_hetero(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a heterosexual male.
     Criterion: sexual_orientation_id in [3, 5] (Mujer hetero, Mujer Bi)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([3, 5])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [3, 5], **location))
 
 
 @router.get("/profiles/recommend/male-homo")
-def list_users_for_male_homo(db: Session = Depends(get_db)):
+def list_users_for_male_homo(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a homosexual male.
     Criterion: sexual_orientation_id in [1, 2] (Hombre homo, Hombre Bi)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([1, 2])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [1, 2], **location))
 
 
 @router.get("/profiles/recommend/male-bi")
-def list_users_for_male_bi(db: Session = Depends(get_db)):
+def list_users_for_male_bi(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a bisexual male.
     Criterion: sexual_orientation_id in [1, 2, 3, 5] (Hombre homo, Hombre Bi, Mujer hetero, Mujer Bi)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([1, 2, 3, 5])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [1, 2, 3, 5], **location))
 
 
 @router.get("/profiles/recommend/female-hetero")
-def list_users_for_female_hetero(db: Session = Depends(get_db)):
+def list_users_for_female_hetero(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a heterosexual female.
     Criterion: sexual_orientation_id in [0, 2] (Hombre hetero, Hombre Bi)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([0, 2])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [0, 2], **location))
 
 
 @router.get("/profiles/recommend/female-homo")
-def list_users_for_female_homo(db: Session = Depends(get_db)):
+def list_users_for_female_homo(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a homosexual female.
     Criterion: sexual_orientation_id in [4, 5] (Mujer homo, Mujer Bi)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([4, 5])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [4, 5], **location))
 
 
 @router.get("/profiles/recommend/female-bi")
-def list_users_for_female_bi(db: Session = Depends(get_db)):
+def list_users_for_female_bi(
+    request: Request,
+    location: dict = Depends(location_params),
+    db: Session = Depends(get_db),
+):
     """
     Return list of user IDs recommendable for a bisexual female.
     Criterion: sexual_orientation_id in [0, 1, 2, 4] (Hombre hetero, Hombre homo, Hombre Bi, Mujer homo)
     """
-    candidates = db.query(models.Profile).filter(
-        models.Profile.sexual_orientation_id.in_([0, 1, 2, 4])
-    ).all()
-    return [profile.id for profile in candidates]
+    return negotiated_response(request, _recommend_ids(db, [0, 1, 2, 4], **location))
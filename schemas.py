@@ -40,6 +40,23 @@ class ProfileUpdate(BaseModel):
     interest_ids: List[int] | None = None
 
 
+class LocationUpdate(BaseModel):
+    latitude: float
+    longitude: float
+
+    @field_validator('latitude')
+    def validate_latitude(cls, latitude):
+        if not -90 <= latitude <= 90:
+            raise ValueError('Latitude must be between -90 and 90')
+        return latitude
+
+    @field_validator('longitude')
+    def validate_longitude(cls, longitude):
+        if not -180 <= longitude <= 180:
+            raise ValueError('Longitude must be between -180 and 180')
+        return longitude
+
+
 class OwnProfileResponse(BaseModel):
     id: int
     username: str
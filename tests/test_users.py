@@ -1,4 +1,5 @@
-from datetime import date
+import struct
+from datetime import date, timedelta
 
 import pytest
 
@@ -6,6 +7,22 @@ from models import SexualOrientation, Interest, Profile, ProfileImage
 import models
 
 
+def add_profile(db_session, profile_id, **fields):
+    """Insert a profile directly (without a profile card) and commit it."""
+    values = {
+        "username": f"user{profile_id}",
+        "birthday": date(1995, 1, 1),
+        "introduction": "Hi",
+        "gender_id": 1,
+        "sexual_orientation_id": 3,
+    }
+    values.update(fields)
+    profile = Profile(id=profile_id, **values)
+    db_session.add(profile)
+    db_session.commit()
+    return profile
+
+
 def test_get_merge_info(client, db_session):
     # seed two orientations and two interests
     o1 = SexualOrientation(orientation_name="Straight")
@@ -60,3 +77,261 @@ def test_create_profile(client, db_session):
     # interest associated?
     assert len(profile.interests) == 1
     assert profile.interests[0].interest_name == "Cooking"
+
+
+def test_recommend_bounded_by_location(client, db_session):
+    gender = models.Gender(gender_name="Mujer")
+    db_session.add(gender)
+    db_session.commit()
+
+    # Madrid, Toledo (~70km away) and Barcelona (~500km away)
+    locations = [(101, 40.4168, -3.7038), (102, 39.8628, -4.0273), (103, 41.3874, 2.1686)]
+    for profile_id, _, _ in locations:
+        add_profile(db_session, profile_id, gender_id=gender.id)
+
+    for profile_id, lat, lon in locations:
+        resp = client.patch(
+            f"/user/profile/location?user_id={profile_id}",
+            json={"latitude": lat, "longitude": lon},
+        )
+        assert resp.status_code == 200
+
+    resp = client.get("/user/profiles/recommend/male-hetero?latitude=40.42&longitude=-3.70&radius_km=100")
+    assert resp.status_code == 200
+    assert resp.json() == [101, 102]
+
+    resp = client.get("/user/profiles/recommend/male-hetero?latitude=40.42&longitude=-3.70&radius_km=100&limit=1")
+    assert resp.json() == [101]
+
+
+@pytest.fixture(scope="module")
+def encoding_profiles(client):
+    # Enough profiles for /user/profiles to exceed MIN_COMPRESS_SIZE
+    ids = list(range(501, 521))
+    for profile_id in ids:
+        client.post(f"/user/complete_profile?user_id={profile_id}", json={
+            "username": f"encoded{profile_id}",
+            "introduction": "A long enough introduction to make the payload compressible.",
+            "birthday": "1995-01-01",
+            "gender_id": 1,
+            "sexual_orientation_id": 3,
+        })
+    return ids
+
+
+def test_recommend_packed_ids(client, encoding_profiles):
+    resp = client.get(
+        "/user/profiles/recommend/male-hetero",
+        headers={"Accept": "application/x-int32-le"},
+    )
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/x-int32-le"
+    ids = list(struct.unpack(f"<{len(resp.content) // 4}i", resp.content))
+    assert set(encoding_profiles) <= set(ids)
+    assert ids == client.get("/user/profiles/recommend/male-hetero").json()
+
+
+@pytest.mark.parametrize("content_encoding", ["gzip", "br"])
+def test_profiles_compressed(client, encoding_profiles, content_encoding):
+    if content_encoding == "br":
+        pytest.importorskip("brotli")
+
+    resp = client.get("/user/profiles", headers={"Accept-Encoding": content_encoding})
+    assert resp.status_code == 200
+    assert resp.headers["content-encoding"] == content_encoding
+    assert "Accept-Encoding" in resp.headers["vary"]
+    # The client decompresses transparently
+    assert set(encoding_profiles) <= {profile["id"] for profile in resp.json()}
+
+
+def test_profiles_msgpack(client, encoding_profiles):
+    msgpack = pytest.importorskip("msgpack")
+
+    resp = client.get("/user/profiles", headers={"Accept": "application/msgpack"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(resp.content) == client.get("/user/profiles").json()
+
+
+def test_content_encoding_honors_q_values():
+    from response_encoding import brotli, choose_content_encoding
+
+    assert choose_content_encoding("gzip;q=1, br;q=0.1") == "gzip"
+    assert choose_content_encoding("gzip;q=0, br;q=0") is None
+    assert choose_content_encoding("identity") is None
+    if brotli is not None:
+        assert choose_content_encoding("gzip, br") == "br"
+
+
+def test_upload_image_deduplicates(client, db_session, monkeypatch):
+    from routers import users_router
+
+    uploads = []
+
+    def fake_upload(file_content, folder="profile_images"):
+        uploads.append(file_content)
+        return f"http://example.com/{len(uploads)}.jpg"
+
+    monkeypatch.setattr(users_router, "upload_image", fake_upload)
+
+    add_profile(db_session, 201, username="uploader")
+
+    files = {"file": ("a.jpg", b"same image bytes", "image/jpeg")}
+    first = client.post("/user/profile/upload-image?user_id=201", files=files)
+    second = client.post("/user/profile/upload-image?user_id=201", files=files)
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.json()["image_id"] == first.json()["image_id"]
+    assert len(uploads) == 1
+
+    # Retried request with the same Idempotency-Key never uploads again
+    headers = {"Idempotency-Key": "retry-1"}
+    files = {"file": ("b.jpg", b"other image bytes", "image/jpeg")}
+    third = client.post("/user/profile/upload-image?user_id=201", files=files, headers=headers)
+    retry = client.post("/user/profile/upload-image?user_id=201", files=files, headers=headers)
+    assert retry.json()["image_id"] == third.json()["image_id"]
+    assert len(uploads) == 2
+
+    # Reusing the key for a different file is a conflict, not a silent match
+    files = {"file": ("c.jpg", b"unrelated image bytes", "image/jpeg")}
+    conflict = client.post("/user/profile/upload-image?user_id=201", files=files, headers=headers)
+    assert conflict.status_code == 409
+    assert len(uploads) == 2
+
+
+def test_profile_card_follows_updates(client, db_session):
+    add_profile(db_session, 301, username="carded", birthday=date(1990, 6, 1), introduction="Before")
+    interest = Interest(interest_name="Climbing")
+    db_session.add(interest)
+    db_session.commit()
+
+    resp = client.patch(
+        "/user/profile?user_id=301",
+        json={"introduction": "After", "interest_ids": [interest.id]},
+    )
+    assert resp.status_code == 200
+
+    card = db_session.get(models.ProfileCard, 301)
+    assert card.introduction == "After"
+    assert card.interests == ["Climbing"]
+
+    resp = client.get("/user/profiles/batch?ids=301&ids=999")
+    assert [profile["id"] for profile in resp.json()] == [301]
+    assert resp.json()[0]["interests"] == ["Climbing"]
+
+    client.delete("/user/profile?user_id=301")
+    db_session.expire_all()
+    assert db_session.get(models.ProfileCard, 301) is None
+
+
+def test_profile_snapshot_incremental(client, db_session, tmp_path, monkeypatch):
+    import profile_snapshot
+    from profile_snapshot import export_snapshot, load_snapshot
+
+    # No overlap window, so only cards changed after the first export are re-read
+    monkeypatch.setattr(profile_snapshot, "SNAPSHOT_OVERLAP", timedelta(0))
+
+    interest = Interest(interest_name="Chess")
+    db_session.add(interest)
+    db_session.commit()
+    for profile_id in (401, 402):
+        resp = client.post(f"/user/complete_profile?user_id={profile_id}", json={
+            "username": f"snap{profile_id}",
+            "introduction": "Hi",
+            "birthday": "1995-01-01",
+            "gender_id": 1,
+            "sexual_orientation_id": 3,
+            "interest_ids": [interest.id] if profile_id == 401 else [],
+        })
+        assert resp.status_code == 200
+
+    path = tmp_path / "profiles.npz"
+    export_snapshot(db_session, path, full=True)
+    client.patch("/user/profile?user_id=402", json={"interest_ids": [interest.id]})
+    client.delete("/user/profile?user_id=401")
+    db_session.expire_all()
+    _, rows_read = export_snapshot(db_session, path)
+    # Only 402 was updated; 401 was deleted and is dropped without a read
+    assert rows_read == 1
+
+    snapshot = load_snapshot(path)
+    ids = list(snapshot["ids"])
+    assert 401 not in ids
+    row = ids.index(402)
+    indptr = snapshot["interest_indptr"]
+    assert list(snapshot["interest_ids"][indptr[row]:indptr[row + 1]]) == [interest.id]
+    assert snapshot["birthday"][row] == date(1995, 1, 1).toordinal()
+
+
+def test_recommend_location_crosses_antimeridian(client, db_session):
+    add_profile(db_session, 111, username="fiji")
+    resp = client.patch("/user/profile/location?user_id=111", json={"latitude": 0.0, "longitude": 179.95})
+    assert resp.status_code == 200
+
+    # ~11km away, on the other side of the antimeridian, from both directions
+    resp = client.get("/user/profiles/recommend/male-hetero?latitude=0&longitude=-179.95&radius_km=20")
+    assert 111 in resp.json()
+    resp = client.get("/user/profiles/recommend/male-hetero?latitude=0&longitude=179.99&radius_km=20")
+    assert 111 in resp.json()
+
+
+def test_backfill_profile_cards(client, db_session):
+    from profile_cards import backfill_profile_cards
+
+    # Created directly, as before profile_cards existed
+    add_profile(db_session, 351, username="legacy", birthday=date(1990, 6, 1), introduction="Old profile")
+    assert 351 not in [profile["id"] for profile in client.get("/user/profiles").json()]
+
+    assert backfill_profile_cards(db_session) >= 1
+    assert backfill_profile_cards(db_session) == 0
+    assert 351 in [profile["id"] for profile in client.get("/user/profiles").json()]
+
+
+def test_profile_snapshot_endpoints(client, db_session, tmp_path, monkeypatch):
+    from config import settings
+    from profile_snapshot import load_snapshot
+
+    path = tmp_path / "profiles.npz"
+    monkeypatch.setattr(settings, "SNAPSHOT_PATH", str(path))
+
+    # GET only serves an existing snapshot, it never writes one
+    assert client.get("/user/profiles/snapshot").status_code == 404
+    assert not path.exists()
+
+    # A profile without a card is still exported
+    add_profile(db_session, 451, username="nocard", birthday=date(1990, 6, 1))
+
+    resp = client.post("/user/profiles/snapshot?full=true")
+    assert resp.status_code == 200
+    assert 451 in list(load_snapshot(path)["ids"])
+
+    resp = client.get("/user/profiles/snapshot")
+    assert resp.status_code == 200
+    assert resp.content == path.read_bytes()
+
+
+def test_create_profile_is_atomic_with_card(client, db_session, monkeypatch):
+    from routers import users_router
+
+    def failing_refresh(db, profile_id):
+        raise RuntimeError("card write failed")
+
+    monkeypatch.setattr(users_router, "refresh_profile_card", failing_refresh)
+    with pytest.raises(RuntimeError):
+        client.post("/user/complete_profile?user_id=601", json={
+            "username": "atomic",
+            "introduction": "Hi",
+            "birthday": "1995-01-01",
+            "gender_id": 1,
+            "sexual_orientation_id": 3,
+        })
+
+    # Nothing was committed without its card
+    assert db_session.get(Profile, 601) is None
+
+
+@pytest.mark.parametrize("query", ["latitude=10", "longitude=10"])
+def test_recommend_rejects_half_location(client, query):
+    resp = client.get(f"/user/profiles/recommend/male-hetero?{query}")
+    assert resp.status_code == 422
+